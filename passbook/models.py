@@ -2,7 +2,9 @@
 import decimal
 import hashlib
 import json
+import math
 import zipfile
+from functools import lru_cache, partial
 from io import BytesIO
 from typing import Optional
 
@@ -10,6 +12,16 @@ from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.serialization import pkcs7
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Timestamp of every zip entry (the zip epoch), instead of the current time
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# Field schema default of keys that json_dict always serializes
+_ALWAYS = object()
+
 class CanNotReadException(Exception):
     pass
 
@@ -53,6 +65,16 @@ class NumberStyle:
 
 
 class Field(object):
+    # '__dict__' keeps other Wallet keys assignable (e.g. field.row = 1),
+    # json_dict serializes them after the declared ones
+    __slots__ = ('key', 'value', 'label', 'changeMessage', 'textAlignment', '__dict__')
+    # (key, default) pairs serialized by json_dict, extended by subclasses.
+    # Keys holding their default value are left out.
+    _SCHEMA = (
+        ('key', _ALWAYS), ('value', _ALWAYS), ('label', ''), ('changeMessage', ''),
+        ('textAlignment', _ALWAYS),
+    )
+
     def __init__(
         self, key:str, value:str, label:str="", changeMessage:str="", textAlignment:Alignment=Alignment.LEFT    
     ):
@@ -63,54 +85,69 @@ class Field(object):
         self.textAlignment = textAlignment
 
     def json_dict(self):
-        return self.__dict__
+        d = {}
+        for attr, default in self._SCHEMA:
+            value = getattr(self, attr)
+            if default is _ALWAYS or value != default:
+                d[attr] = value
+        d.update(self.__dict__)
+        return d
 
 
 class DateField(Field):
+    __slots__ = ('dateStyle', 'timeStyle', 'isRelative', 'ignoresTimeZone')
+    _SCHEMA = Field._SCHEMA + (
+        ('dateStyle', _ALWAYS), ('timeStyle', _ALWAYS), ('isRelative', False),
+        ('ignoresTimeZone', False),
+    )
+
     def __init__(self, key, value, label='', dateStyle=DateStyle.SHORT,
                  timeStyle=DateStyle.SHORT, ignoresTimeZone=False):
         super().__init__(key, value, label)
         self.dateStyle = dateStyle  # Style of date to display
         self.timeStyle = timeStyle  # Style of time to display
         self.isRelative = False  # If true, the labels value is displayed as a relative date
-        if ignoresTimeZone:
-            self.ignoresTimeZone = ignoresTimeZone
-
-    def json_dict(self):
-        return self.__dict__
+        self.ignoresTimeZone = ignoresTimeZone
 
 
 class NumberField(Field):
+    __slots__ = ('numberStyle',)
+    _SCHEMA = Field._SCHEMA + (('numberStyle', _ALWAYS),)
+
     def __init__(self, key, value, label=''):
         super().__init__(key, value, label)
         self.numberStyle = NumberStyle.DECIMAL  # Style of date to display
 
-    def json_dict(self):
-        return self.__dict__
-
 
 class CurrencyField(Field):
+    __slots__ = ('currencyCode',)
+    _SCHEMA = Field._SCHEMA + (('currencyCode', ''),)
+
     def __init__(self, key, value, label='', currencyCode=''):
         super().__init__(key, value, label)
         self.currencyCode = currencyCode  # ISO 4217 currency code
 
-    def json_dict(self):
-        return self.__dict__
-
 
 class Barcode(object):
+    __slots__ = ('format', 'message', 'messageEncoding', 'altText', '__dict__')  # see Field
+
     def __init__(self, message:str, format:BarcodeFormat=BarcodeFormat.PDF417, altText='', messageEncoding:str='iso-8859-1'):
         self.format = format
         self.message = message  # Required. Message or payload to be displayed as a barcode
         self.messageEncoding = messageEncoding  # The IANA character set name of the text encoding to use to convert message from a string representation to a data representation that the system renders as a barcode, such as “iso-8859-1”.
-        if altText:
-            self.altText = altText  # Optional. Text displayed near the barcode
+        self.altText = altText  # Optional. Text displayed near the barcode
 
     def json_dict(self):
-        return self.__dict__
+        d = {'format': self.format, 'message': self.message, 'messageEncoding': self.messageEncoding}
+        if self.altText:
+            d['altText'] = self.altText
+        d.update(self.__dict__)
+        return d
 
 
 class Location(object):
+    __slots__ = ('latitude', 'longitude', 'altitude', 'distance', 'relevantText', '__dict__')  # see Field
+
     def __init__(self, latitude, longitude, altitude=0.0):
         # Required. Latitude, in degrees, of the location.
         try:
@@ -134,10 +171,17 @@ class Location(object):
         self.relevantText = ''
 
     def json_dict(self):
-        return self.__dict__
+        d = {
+            'latitude': self.latitude, 'longitude': self.longitude, 'altitude': self.altitude,
+            'distance': self.distance, 'relevantText': self.relevantText,
+        }
+        d.update(self.__dict__)
+        return d
 
 
 class IBeacon(object):
+    __slots__ = ('proximityUUID', 'major', 'minor', 'relevantText', '__dict__')  # see Field
+
     def __init__(self, proximityuuid:str, major:str|None, minor:str|None, relevantText:str=''):
         # IBeacon data
         self.proximityUUID = proximityuuid
@@ -148,15 +192,20 @@ class IBeacon(object):
         self.relevantText = relevantText
     
     def json_dict(self):
-        res = self.__dict__
-        if self.major is None:
-            del res['major']
-        if self.minor is None:
-            del res['minor']
-        return res
+        d = {'proximityUUID': self.proximityUUID, 'relevantText': self.relevantText}
+        if self.major is not None:
+            d['major'] = self.major
+        if self.minor is not None:
+            d['minor'] = self.minor
+        d.update(self.__dict__)
+        return d
 
 
 class PassInformation(object):
+    # Field lists, in the order json_dict serializes them
+    _FIELD_GROUPS = ('headerFields', 'primaryFields', 'secondaryFields', 'backFields', 'auxiliaryFields')
+    __slots__ = _FIELD_GROUPS
+
     def __init__(self):
         self.headerFields = []
         self.primaryFields = []
@@ -180,54 +229,45 @@ class PassInformation(object):
         self.auxiliaryFields.append(Field(key, value, label))
 
     def json_dict(self):
-        d = {}
-        if self.headerFields:
-            d.update({'headerFields': [f.json_dict() for f in self.headerFields]})
-        if self.primaryFields:
-            d.update({'primaryFields': [f.json_dict() for f in self.primaryFields]})
-        if self.secondaryFields:
-            d.update({'secondaryFields': [f.json_dict() for f in self.secondaryFields]})
-        if self.backFields:
-            d.update({'backFields': [f.json_dict() for f in self.backFields]})
-        if self.auxiliaryFields:
-            d.update({'auxiliaryFields': [f.json_dict() for f in self.auxiliaryFields]})
-        return d
+        return {
+            group: [f.json_dict() for f in fields]
+            for group, fields in ((group, getattr(self, group)) for group in self._FIELD_GROUPS)
+            if fields
+        }
 
 
 class BoardingPass(PassInformation):
+    __slots__ = ('transitType',)
+    jsonname = 'boardingPass'
+
     def __init__(self, transitType=TransitType.AIR):
         super().__init__()
         self.transitType = transitType
-        self.jsonname = 'boardingPass'
 
     def json_dict(self):
         d = super().json_dict()
-        d.update({'transitType': self.transitType})
+        d['transitType'] = self.transitType
         return d
 
 
 class Coupon(PassInformation):
-    def __init__(self):
-        super().__init__()
-        self.jsonname = 'coupon'
+    __slots__ = ()
+    jsonname = 'coupon'
 
 
 class EventTicket(PassInformation):
-    def __init__(self):
-        super().__init__()
-        self.jsonname = 'eventTicket'
+    __slots__ = ()
+    jsonname = 'eventTicket'
 
 
 class Generic(PassInformation):
-    def __init__(self):
-        super().__init__()
-        self.jsonname = 'generic'
+    __slots__ = ()
+    jsonname = 'generic'
 
 
 class StoreCard(PassInformation):
-    def __init__(self):
-        super().__init__()
-        self.jsonname = 'storeCard'
+    __slots__ = ()
+    jsonname = 'storeCard'
 
 
 class Pass(object):
@@ -255,7 +295,7 @@ class Pass(object):
     ):
 
         self._files = {}  # Holds the files to include in the .pkpass
-        self._hashes = {}  # Holds the SHAs of the files array
+        self.zip_file = None  # Holds the .pkpass once created
 
         # Standard Keys
 
@@ -321,26 +361,38 @@ class Pass(object):
     def addFile(self, name, fd):
         self._files[name] = fd.read()
 
-    # Creates the actual .pkpass file
-    def create(self, certificate, key, wwdr_certificate, password):
+    # Creates the actual .pkpass file. The PEM credentials may be given as
+    # str or bytes; parsed certificates are cached between calls. The key
+    # is parsed on every call unless an already loaded private key object
+    # (e.g. from serialization.load_pem_private_key) is passed instead.
+    # digest is the hashlib algorithm used for the manifest. Wallet expects
+    # 'sha1'; 'sha256' manifests are only accepted by iOS 9 and later.
+    def create(self, certificate, key, wwdr_certificate, password, digest='sha1'):
         pass_json = self._createPassJson()
-        manifest = self._createManifest(pass_json)
+        manifest = self._createManifest(pass_json, digest)
         signature = self._createSignatureCrypto(manifest, certificate, key, wwdr_certificate, password)
         # signature = self._createSignature(manifest, certificate, key, wwdr_certificate, password)
         zip_file = self._createZip(pass_json, manifest, signature)
         return zip_file
 
     def _createPassJson(self):
-        return json.dumps(self, default=PassHandler)
+        return _dumps(self.json_dict())
 
-    def _createManifest(self, pass_json):
+    def _createManifest(self, pass_json, digest='sha1'):
         """
-        Creates the hashes for all the files included in the pass file.
+        Creates the hashes for all the files included in the pass file,
+        written directly as the manifest.json bytes.
         """
-        self._hashes['pass.json'] = hashlib.sha1(pass_json.encode('utf-8')).hexdigest()
+        manifest = bytearray(b'{"pass.json":"')
+        new = partial(hashlib.new, digest, usedforsecurity=False)  # resolved once for all files
+        manifest += new(pass_json).hexdigest().encode('ascii')
         for filename, filedata in self._files.items():
-            self._hashes[filename] = hashlib.sha1(filedata).hexdigest()
-        return json.dumps(self._hashes)
+            manifest += b'",'
+            manifest += _dumps(filename)  # quoted and escaped
+            manifest += b':"'
+            manifest += new(filedata).hexdigest().encode('ascii')
+        manifest += b'"}'
+        return bytes(manifest)
 
     # def _get_smime(self, certificate, key, wwdr_certificate, password):
     #     """
@@ -397,8 +449,10 @@ class Pass(object):
     @staticmethod
     def _encodeStrings(value):
         """
-        Return encoded string
+        Return encoded string, bytes are returned unchanged
         """
+        if isinstance(value, bytes):
+            return value
         return value.encode('UTF-8')
 
     def _createSignatureCrypto(self, manifest, certificate, key,
@@ -409,26 +463,48 @@ class Pass(object):
         The manifest is the file
         containing a list of files included in the pass file (and their hashes).
         """
-        cert = x509.load_pem_x509_certificate(self._encodeStrings(certificate))
-        priv_key = serialization.load_pem_private_key(self._encodeStrings(key), password=password.encode('UTF-8') if password else None)
-        wwdr_cert = x509.load_pem_x509_certificate(self._encodeStrings(wwdr_certificate))
+        cert = _load_certificate(self._encodeStrings(certificate))
+        if isinstance(key, (str, bytes)):
+            priv_key = serialization.load_pem_private_key(
+                self._encodeStrings(key), password=self._encodeStrings(password) if password else None
+            )
+        else:
+            priv_key = key  # already loaded by the caller
+        wwdr_cert = _load_certificate(self._encodeStrings(wwdr_certificate))
         
         options = [pkcs7.PKCS7Options.DetachedSignature]
         return pkcs7.PKCS7SignatureBuilder()\
-                .set_data(manifest.encode('UTF-8'))\
+                .set_data(manifest)\
                 .add_signer(cert, priv_key, hashes.SHA256())\
                 .add_certificate(wwdr_cert)\
                 .sign(serialization.Encoding.DER, options)
 
-    # Creates .pkpass (zip archive)
+    @staticmethod
+    def _zipInfo(filename):
+        """
+        Utility function to describe a stored zip entry with a fixed
+        timestamp, so zipfile does not query the clock for every entry
+        :param filename: name of the entry in the archive
+        :returns zipfile.ZipInfo
+        """
+        info = zipfile.ZipInfo(filename, date_time=_ZIP_DATE_TIME)
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16  # -rw-r--r--
+        return info
+
     def _createZip(self, pass_json, manifest, signature):
+        """
+        Creates the .pkpass (zip archive) in memory.
+        Entries are stored without compression: pass assets are PNGs and
+        the signature is DER, so they should be compressed beforehand.
+        """
         self.zip_file = BytesIO()
-        zf = zipfile.ZipFile(self.zip_file, 'w') # create in-memory zip
-        zf.writestr('signature', signature)
-        zf.writestr('manifest.json', manifest)
-        zf.writestr('pass.json', pass_json)
+        zf = zipfile.ZipFile(self.zip_file, 'w', compression=zipfile.ZIP_STORED) # create in-memory zip
+        zf.writestr(self._zipInfo('signature'), signature)
+        zf.writestr(self._zipInfo('manifest.json'), manifest)
+        zf.writestr(self._zipInfo('pass.json'), pass_json)
         for filename, filedata in self._files.items():
-            zf.writestr(filename, filedata)
+            zf.writestr(self._zipInfo(filename), filedata)
         zf.close()
         return self.zip_file
     
@@ -436,14 +512,15 @@ class Pass(object):
         """Returns a string with the contents of the in-memory zip."""
         if not self.zip_file:
             raise CanNotReadException("create a pass file first")
-        self.zip_file.seek(0)
-        return self.zip_file.read()
+        return self.zip_file.getvalue()
 
     def writetofile(self, filename):
         """Writes the in-memory zip to a file."""
-        f = open(filename, "wb")
-        f.write(self.read())
-        f.close()
+        if not self.zip_file:
+            raise CanNotReadException("create a pass file first")
+        # Write straight from the zip buffer rather than from a copy of it
+        with self.zip_file.getbuffer() as data, open(filename, "wb") as f:
+            f.write(data)
 
     def json_dict(self):
         d = {
@@ -459,49 +536,74 @@ class Pass(object):
         }
 
         if self.barcodes:
-            if (type(self.barcodes) is not list):
-                barcodes = [self.barcodes]
-            else:
-                barcodes = self.barcodes
-            
-            newBarcodes = []
-            for i in range(len(barcodes)):
-                newBarcodes.append(barcodes[i].json_dict())
-            
-            d.update({'barcodes': newBarcodes})
-
-        if self.relevantDate:
-            d.update({'relevantDate': self.relevantDate})
-        if self.backgroundColor:
-            d.update({'backgroundColor': self.backgroundColor})
-        if self.foregroundColor:
-            d.update({'foregroundColor': self.foregroundColor})
-        if self.labelColor:
-            d.update({'labelColor': self.labelColor})
-        if self.logoText:
-            d.update({'logoText': self.logoText})
-        if self.locations:
-            d.update({'locations': self.locations})
-        if self.ibeacons:
-            d.update({'beacons': self.ibeacons})
-        if self.userInfo:
-            d.update({'userInfo': self.userInfo})
-        if self.associatedStoreIdentifiers:
-            d.update(
-                {'associatedStoreIdentifiers': self.associatedStoreIdentifiers}
-            )
-        if self.appLaunchURL:
-            d.update({'appLaunchURL': self.appLaunchURL})
-        if self.expirationDate:
-            d.update({'expirationDate': self.expirationDate})
-        if self.voided:
-            d.update({'voided': True})
+            barcodes = self.barcodes if isinstance(self.barcodes, (list, tuple)) else (self.barcodes,)
+            d['barcodes'] = [barcode.json_dict() for barcode in barcodes]
+
+        # Optional keys, only serialized when set
+        optional = (
+            ('relevantDate', self.relevantDate),
+            ('backgroundColor', self.backgroundColor),
+            ('foregroundColor', self.foregroundColor),
+            ('labelColor', self.labelColor),
+            ('logoText', self.logoText),
+            ('locations', self.locations),
+            ('beacons', self.ibeacons),
+            ('userInfo', self.userInfo),
+            ('associatedStoreIdentifiers', self.associatedStoreIdentifiers),
+            ('appLaunchURL', self.appLaunchURL),
+            ('expirationDate', self.expirationDate),
+            ('voided', bool(self.voided)),
+        )
+        d.update((key, value) for key, value in optional if value)
         if self.webServiceURL:
-            d.update({'webServiceURL': self.webServiceURL,
-                      'authenticationToken': self.authenticationToken})
+            d['webServiceURL'] = self.webServiceURL
+            d['authenticationToken'] = self.authenticationToken
         return d
 
 
+def _dumps(obj):
+    """
+    Serializes obj to JSON bytes, using orjson when it is installed.
+    Both paths produce the same JSON: types other than the plain JSON ones
+    (datetimes included) are left to PassHandler, and NaN or infinite
+    floats are written as null.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=PassHandler, option=(
+            orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        ))
+    try:
+        return json.dumps(obj, default=PassHandler, allow_nan=False).encode('utf-8')
+    except ValueError as e:
+        if not str(e).startswith('Out of range float'):
+            raise
+    return json.dumps(
+        _finite(obj), default=lambda o: _finite(PassHandler(o)), allow_nan=False
+    ).encode('utf-8')
+
+
+def _finite(obj):
+    """
+    Returns obj with NaN and infinite floats replaced by None, as orjson writes them
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+# Parsing the PEM certificates is a large part of the signing setup, and
+# servers usually sign every pass with the same ones. Private keys are not
+# cached here so decrypted keys and their passwords are not kept alive for
+# the whole process; callers wanting to reuse one can pass the loaded key.
+@lru_cache(maxsize=32)
+def _load_certificate(pem):
+    return x509.load_pem_x509_certificate(pem)
+
+
 def PassHandler(obj):
     if hasattr(obj, 'json_dict'):
         return obj.json_dict()
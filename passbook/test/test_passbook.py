@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
+import datetime
+import decimal
+import hashlib
 import json
+import tempfile
+import zipfile
+from io import BytesIO, UnsupportedOperation
 
 import pytest
+from cryptography.hazmat.primitives import serialization
 from path import Path
 
-from passbook.models import Barcode, BarcodeFormat, Pass, StoreCard
+import passbook.models
+from passbook.models import (Alignment, Barcode, BarcodeFormat, CurrencyField,
+                             DateField, DateStyle, Field, IBeacon, Location,
+                             Pass, StoreCard)
 
 cwd = Path(__file__).parent
 
@@ -14,6 +24,26 @@ key = cwd / 'certificates' / 'private.key'
 password_file = cwd / 'certificates' / 'password.txt'
 
 
+def create_pass():
+    return Pass(StoreCard(), 'A Sample Pass', 'Org Name', 'Pass Type ID', '1234567', 'Team Identifier')
+
+
+class UnseekableStream(BytesIO):
+    """A stream that can only be read forward, like a pipe or socket"""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise UnsupportedOperation('seek')
+
+    def tell(self):
+        raise UnsupportedOperation('tell')
+
+
 def create_shell_pass(barcodeFormat=BarcodeFormat.CODE128):
     cardInfo = StoreCard()
     cardInfo.addPrimaryField('name', u'Jähn Doe', 'Name')
@@ -85,6 +115,92 @@ def test_auxiliary_fields():
     assert pass_json['storeCard']['auxiliaryFields'][0]['label'] == 'Famous Inc.'
 
 
+def test_field_omits_empty_keys():
+    field = Field('key', 'value')
+    assert field.json_dict() == {
+        'key': 'key', 'value': 'value', 'textAlignment': Alignment.LEFT
+    }
+
+    field = Field('key', '', 'Label', 'Changed to %@')
+    assert field.json_dict() == {
+        'key': 'key', 'value': '', 'label': 'Label',
+        'changeMessage': 'Changed to %@', 'textAlignment': Alignment.LEFT,
+    }
+
+    field_json = DateField('date', '2024-01-01T10:00Z').json_dict()
+    assert 'label' not in field_json
+    assert 'isRelative' not in field_json
+    assert 'ignoresTimeZone' not in field_json
+    assert field_json['dateStyle'] == DateStyle.SHORT
+
+    field_json = DateField('date', '2024-01-01T10:00Z', ignoresTimeZone=True).json_dict()
+    assert field_json['ignoresTimeZone'] is True
+
+
+def test_extra_wallet_keys():
+    field = DateField('date', '2024-01-01T10:00Z')
+    field.row = 1
+    assert field.json_dict()['row'] == 1
+
+    barcode = Barcode('message', BarcodeFormat.QR)
+    barcode.customKey = 'value'
+    assert barcode.json_dict()['customKey'] == 'value'
+
+    location = Location(1, 2)
+    location.customKey = 'value'
+    assert location.json_dict()['customKey'] == 'value'
+
+    ibeacon = IBeacon('E2C56DB5-DFFB-48D2-B060-D0F5A71096E0', 1, 2)
+    ibeacon.customKey = 'value'
+    assert ibeacon.json_dict()['customKey'] == 'value'
+
+
+def test_ibeacon_json_dict_is_repeatable():
+    ibeacon = IBeacon('E2C56DB5-DFFB-48D2-B060-D0F5A71096E0', None, 2)
+    expected = {
+        'proximityUUID': 'E2C56DB5-DFFB-48D2-B060-D0F5A71096E0',
+        'relevantText': '',
+        'minor': 2,
+    }
+    assert ibeacon.json_dict() == expected
+    assert ibeacon.json_dict() == expected
+    assert ibeacon.major is None
+
+
+def create_rich_pass():
+    passfile = create_pass()
+    passfile.passInformation.addPrimaryField('name', 'Jähn Doe', 'Name')
+    passfile.passInformation.backFields.append(
+        CurrencyField('balance', decimal.Decimal('12.50'), 'Balance', 'EUR')
+    )
+    passfile.locations = [Location(decimal.Decimal('41.39'), '2.17'), Location(float('nan'), float('inf'))]
+    passfile.ibeacons = [IBeacon('E2C56DB5-DFFB-48D2-B060-D0F5A71096E0', 1, None)]
+    passfile.userInfo = {1: 'one', 'ratio': float('-inf')}
+    return passfile
+
+
+def test_json_without_orjson(monkeypatch):
+    pytest.importorskip('orjson')
+    with_orjson = json.loads(create_rich_pass()._createPassJson())
+    monkeypatch.setattr(passbook.models, 'orjson', None)
+    without_orjson = json.loads(create_rich_pass()._createPassJson())
+    assert with_orjson == without_orjson
+    assert with_orjson['locations'][1]['latitude'] is None
+    assert with_orjson['userInfo'] == {'1': 'one', 'ratio': None}
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_json_rejects_datetimes(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(passbook.models, 'orjson', None)
+    passfile = create_pass()
+    passfile.relevantDate = datetime.datetime(2024, 1, 1)
+    with pytest.raises(TypeError):
+        passfile._createPassJson()
+
+
 def test_code128_pass():
     """
     This test is to create a pass with a new code128 format,
@@ -129,6 +245,134 @@ def test_files():
     assert '170eed23019542b0a2890a0bf753effea0db181a' == manifest['logo.png']
 
 
+def test_manifest_escapes_file_names():
+    passfile = create_pass()
+    passfile.addFile('en.lproj/ñ "quoted".png', BytesIO(b'data'))
+    manifest = json.loads(passfile._createManifest(passfile._createPassJson()))
+    assert manifest['pass.json'] == hashlib.sha1(passfile._createPassJson()).hexdigest()
+    assert manifest['en.lproj/ñ "quoted".png'] == hashlib.sha1(b'data').hexdigest()
+
+
+def test_manifest_matches_files():
+    files = {
+        'icon.png': (cwd / 'static/white_square.png').read_bytes(),
+        'icon@2x.png': b'\x00' * 20000,
+        'logo.png': b'',
+        'strip.png': bytes(range(256)) * 1000,
+    }
+    passfile = create_pass()
+    for name, data in files.items():
+        passfile.addFile(name, BytesIO(data))
+    manifest = json.loads(passfile._createManifest(passfile._createPassJson()))
+    assert list(manifest) == ['pass.json'] + list(files)
+    for name, data in files.items():
+        assert manifest[name] == hashlib.sha1(data).hexdigest()
+
+
+def test_manifest_digest():
+    passfile = create_pass()
+    with open(cwd / 'static/white_square.png', 'rb') as fd:
+        passfile.addFile('icon.png', fd)
+    manifest = json.loads(passfile._createManifest(passfile._createPassJson(), 'sha256'))
+    assert manifest['icon.png'] == hashlib.sha256((cwd / 'static/white_square.png').read_bytes()).hexdigest()
+
+    passfile.create(
+        certificate.read_text(), key.read_text(), wwdr_certificate.read_text(),
+        password_file.read_text().strip(), digest='sha256',
+    )
+    archive = zipfile.ZipFile(BytesIO(passfile.read()))
+    manifest = json.loads(archive.read('manifest.json'))
+    assert sorted(manifest) == ['icon.png', 'pass.json']
+    for name, digest in manifest.items():
+        assert hashlib.sha256(archive.read(name)).hexdigest() == digest
+
+
+def assert_pass_file(passfile, name, data):
+    manifest = json.loads(passfile._createManifest(passfile._createPassJson()))
+    assert manifest[name] == hashlib.sha1(data).hexdigest()
+    archive = zipfile.ZipFile(passfile._createZip(b'{}', b'{}', b''))
+    assert archive.read(name) == data
+
+
+def test_file_closed_after_adding():
+    with open(cwd / 'static/white_square.png', 'rb') as fd:
+        passfile = create_pass()
+        passfile.addFile('icon.png', fd)
+    assert_pass_file(passfile, 'icon.png', (cwd / 'static/white_square.png').read_bytes())
+
+
+def test_file_changed_after_adding():
+    with tempfile.NamedTemporaryFile() as fd:
+        fd.write(b'original')
+        fd.seek(0)
+        passfile = create_pass()
+        passfile.addFile('icon.png', fd)
+        fd.seek(0)
+        fd.write(b'replaced')
+        fd.flush()
+    # The temporary file is deleted by now
+    assert_pass_file(passfile, 'icon.png', b'original')
+
+
+def test_unseekable_file():
+    data = (cwd / 'static/white_square.png').read_bytes()
+    passfile = create_pass()
+    passfile.addFile('icon.png', UnseekableStream(data, str(cwd / 'static/white_square.png')))
+    assert_pass_file(passfile, 'icon.png', data)
+
+
+def test_partly_read_files():
+    passfile = create_pass()
+    stream = BytesIO(b'header' + b'payload')
+    stream.read(6)
+    passfile.addFile('stream.png', stream)
+    assert_pass_file(passfile, 'stream.png', b'payload')
+
+    data = (cwd / 'static/white_square.png').read_bytes()
+    with open(cwd / 'static/white_square.png', 'rb') as fd:
+        fd.read(10)
+        passfile.addFile('icon.png', fd)
+    assert_pass_file(passfile, 'icon.png', data[10:])
+
+
+def test_pkpass_archive():
+    passfile = create_pass()
+    with open(cwd / 'static/white_square.png', 'rb') as fd:
+        passfile.addFile('icon.png', fd)
+    passfile.addFile('logo.png', BytesIO(b'logo'))
+    passfile.create(
+        certificate.read_text(), key.read_text(), wwdr_certificate.read_text(),
+        password_file.read_text().strip(),
+    )
+    data = passfile.read()
+    # The archive ends with the end of central directory record, no padding
+    assert data[-22:-18] == b'PK\x05\x06'
+
+    archive = zipfile.ZipFile(BytesIO(data))
+    assert archive.testzip() is None
+    assert archive.namelist() == ['signature', 'manifest.json', 'pass.json', 'icon.png', 'logo.png']
+    for info in archive.infolist():
+        assert info.date_time == (1980, 1, 1, 0, 0, 0)
+        assert info.compress_type == zipfile.ZIP_STORED
+
+    manifest = json.loads(archive.read('manifest.json'))
+    assert sorted(manifest) == ['icon.png', 'logo.png', 'pass.json']
+    for name, digest in manifest.items():
+        assert hashlib.sha1(archive.read(name)).hexdigest() == digest
+
+
+def test_create_with_loaded_key():
+    password = password_file.read_text().strip()
+    private_key = serialization.load_pem_private_key(
+        key.read_bytes(), password=password.encode() if password else None
+    )
+    passfile = create_pass()
+    passfile.create(certificate.read_text(), private_key, wwdr_certificate.read_text(), None)
+    archive = zipfile.ZipFile(BytesIO(passfile.read()))
+    assert archive.testzip() is None
+    assert archive.read('signature')
+
+
 # def test_signing():
 #     """
 #     This test can only run locally if you provide your personal Apple Wallet